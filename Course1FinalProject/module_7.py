@@ -308,11 +308,8 @@ def exec_waypoint_nav_demo(args):
         
         # Linear interpolation computations
         # Compute a list of distances between waypoints
-        wp_distance = []   # distance array
-        for i in range(1, waypoints_np.shape[0]):
-            wp_distance.append(
-                    np.sqrt((waypoints_np[i, 0] - waypoints_np[i-1, 0])**2 +
-                            (waypoints_np[i, 1] - waypoints_np[i-1, 1])**2))
+        wp_distance = np.hypot(np.diff(waypoints_np[:, 0]),
+                               np.diff(waypoints_np[:, 1])).tolist()
         wp_distance.append(0)  # last distance is 0 because it is the distance
                                # from the last waypoint to the last waypoint
 
@@ -345,6 +342,9 @@ def exec_waypoint_nav_demo(args):
         wp_interp.append(list(waypoints_np[-1]))
         wp_interp_hash.append(interp_counter)   
         interp_counter+=1
+        # Array copy of the interpolated waypoints, so the controller can be
+        # handed views into it rather than a new list every frame
+        wp_interp_np = np.array(wp_interp)
 
         #############################################
         # Controller 2D Class Declaration
@@ -499,7 +499,10 @@ def exec_waypoint_nav_demo(args):
         skip_first_frame = True
         closest_index    = 0  # Index of waypoint that is currently closest to
                               # the car (assumed to be the first index)
-        closest_distance = 0  # Closest distance of closest waypoint to car
+        closest_distance = 0  # Closest (squared) distance of closest
+                              # waypoint to car
+        waypoint_subset  = None  # (first, last + 1) interpolated indices of
+                                 # the waypoints sent to the controller
         for frame in range(TOTAL_EPISODE_FRAMES):
             # Gather current data from the CARLA server
             measurement_data, sensor_data = client.read_data()
@@ -540,9 +543,11 @@ def exec_waypoint_nav_demo(args):
             # the car will always break out of instability points where there
             # are two indices with the same minimum distance, as in the
             # center of a circle)
-            closest_distance = np.linalg.norm(np.array([
-                    waypoints_np[closest_index, 0] - current_x,
-                    waypoints_np[closest_index, 1] - current_y]))
+            # Squared distances are compared, since only their ordering
+            # matters; this avoids a sqrt and a temporary array per step.
+            dx = waypoints_np[closest_index, 0] - current_x
+            dy = waypoints_np[closest_index, 1] - current_y
+            closest_distance = dx*dx + dy*dy
             new_distance = closest_distance
             new_index = closest_index
             while new_distance <= closest_distance:
@@ -551,9 +556,9 @@ def exec_waypoint_nav_demo(args):
                 new_index += 1
                 if new_index >= waypoints_np.shape[0]:  # End of path
                     break
-                new_distance = np.linalg.norm(np.array([
-                        waypoints_np[new_index, 0] - current_x,
-                        waypoints_np[new_index, 1] - current_y]))
+                dx = waypoints_np[new_index, 0] - current_x
+                dy = waypoints_np[new_index, 1] - current_y
+                new_distance = dx*dx + dy*dy
             new_distance = closest_distance
             new_index = closest_index
             while new_distance <= closest_distance:
@@ -562,9 +567,9 @@ def exec_waypoint_nav_demo(args):
                 new_index -= 1
                 if new_index < 0:  # Beginning of path
                     break
-                new_distance = np.linalg.norm(np.array([
-                        waypoints_np[new_index, 0] - current_x,
-                        waypoints_np[new_index, 1] - current_y]))
+                dx = waypoints_np[new_index, 0] - current_x
+                dy = waypoints_np[new_index, 1] - current_y
+                new_distance = dx*dx + dy*dy
 
             # Once the closest index is found, return the path that has 1
             # waypoint behind and X waypoints ahead, where X is the index
@@ -586,10 +591,14 @@ def exec_waypoint_nav_demo(args):
             # Use the first and last waypoint subset indices into the hash
             # table to obtain the first and last indicies for the interpolated
             # list. Update the interpolated waypoints to the controller
-            # for the next controller update.
-            new_waypoints = \
-                    wp_interp[wp_interp_hash[waypoint_subset_first_index]:\
-                              wp_interp_hash[waypoint_subset_last_index] + 1]
+            # for the next controller update. The same view is passed again
+            # while the subset is unchanged, so the controller can keep its
+            # cached waypoint data.
+            subset = (wp_interp_hash[waypoint_subset_first_index],
+                      wp_interp_hash[waypoint_subset_last_index] + 1)
+            if subset != waypoint_subset:
+                waypoint_subset = subset
+                new_waypoints = wp_interp_np[subset[0]:subset[1]]
             controller.update_waypoints(new_waypoints)
 
             # Update the other controller values and controls
@@ -609,7 +618,7 @@ def exec_waypoint_nav_demo(args):
                 # When plotting lookahead path, only plot a number of points
                 # (INTERP_MAX_POINTS_PLOT amount of points). This is meant
                 # to decrease load when live plotting
-                new_waypoints_np = np.array(new_waypoints)
+                new_waypoints_np = new_waypoints
                 path_indices = np.floor(np.linspace(0, 
                                                     new_waypoints_np.shape[0]-1,
                                                     INTERP_MAX_POINTS_PLOT))